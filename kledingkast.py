@@ -13,6 +13,30 @@
 ###############################################################################
 
 # Import required classes and functions
+from collections import Counter
+import contextlib
+import ctypes
+import gc
+import hashlib
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import struct
+import time
+import tokenize
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, the order store is then not locked between processes
+    fcntl = None
+
+import numpy as np
+
 from build123d import (
     BuildPart,
     Box,
@@ -28,16 +52,24 @@ from build123d import (
     Color,
     Part,
     chamfer,
-    Vector
+    Vector,
+    GeomType,
+    Shape
 )
 from bd_warehouse.fastener import CounterSunkScrew
 
-from ocp_vscode import show
+from ocp_vscode import show, Animation, Camera
 
 # Manually set port
 from ocp_vscode.comms import CMD_PORT, set_port
 set_port(3939)  # Use a specific port number
 
+# Batch workers run the cells headless, without sending anything to the viewer
+headless = globals().get("headless", False)
+if headless:
+    def show(*args, **kwargs):
+        pass
+
 
 # %%
 ###############################################################################
@@ -83,6 +115,18 @@ METRIC_DOWEL_SIZES = {
     "10mm": (1.0, 5.0),
 }
 
+# Material densities (g/cm³) for part weights and the tip-over check
+MATERIAL_DENSITIES = {
+    "board": 0.65,       # 18mm chipboard panels
+    "back panel": 0.8,   # 12mm back panels
+    "mirror": 2.5,       # Mirror glass
+    "dowel": 0.7,        # Beech dowels
+    "steel": 7.85,       # Rails, bars and screws
+}
+
+# Batch workers build their variant by overriding the parameters above
+globals().update(globals().get("variant_parameters", {}))
+
 # Derived parameters
 dowel_length = METRIC_DOWEL_SIZES[dowel_size][1]
 
@@ -270,18 +314,39 @@ def create_between_panels(part_factory, part_length, panel_side, panel_front, sp
     
     return Compound(dowels)
 
+def mirror_children(assembly, about=Plane.YZ):
+    # Mirror the children one by one, mirroring the whole compound at once
+    # loses their labels
+    mirrored_children = []
+    for child in assembly.children:
+        mirrored_child = mirror(child, about=about)
+        if len(mirrored_child.solids()) == 1:
+            # Panels come back wrapped in a compound
+            mirrored_child = mirrored_child.solids()[0]
+        mirrored_child.label = child.label
+        mirrored_children.append(mirrored_child)
+    return Compound(children=mirrored_children)
+
 # %%
 ###############################################################################
 #                             DOWEL PLACEMENT                                 #
 #              Adding dowels between panels for extra strength                #
 ###############################################################################
+# One dowel per size, every placed dowel is a located copy sharing its geometry
+dowel_prototypes = {}
+
 def create_dowels_between_panels(panel_side, panel_front, spacing=20.0, front_thickness=1.8):
     dow_sz = dowel_size
     dow_len = dowel_length
     if front_thickness < 1.8:
         dow_sz = "6mm"
         dow_len = 3.0
-    return create_between_panels(lambda: WoodenDowel(dow_sz), dow_len, panel_side, panel_front, spacing=spacing, front_thickness=front_thickness)
+    if dow_sz not in dowel_prototypes:
+        dowel_prototypes[dow_sz] = WoodenDowel(dow_sz)
+    prototype = dowel_prototypes[dow_sz]
+    dowels = create_between_panels(lambda: copy(prototype), dow_len, panel_side, panel_front, spacing=spacing, front_thickness=front_thickness)
+    dowels.label = "Dowels"
+    return dowels
 
 # Example: Create two panels
 # rotate and locate the panels
@@ -301,7 +366,9 @@ dowels = create_dowels_between_panels(panel_side, panel_front)
 def create_screws_between_panels(panel_side, panel_front):
     def create_screw():
         return CounterSunkScrew(fastener_type="iso14581", size="M4-0.7", length=35).scale(.1)
-    return create_between_panels(create_screw, 3.5, panel_side, panel_front, spacing=40.0, front_thickness=thickness, is_center_aligned=False, offset=10.0)
+    screws = create_between_panels(create_screw, 3.5, panel_side, panel_front, spacing=40.0, front_thickness=thickness, is_center_aligned=False, offset=10.0)
+    screws.label = "Screws"
+    return screws
 
 screws = create_screws_between_panels(panel_side, panel_front)
 show([panel_front, panel_side, screws, dowels])
@@ -382,7 +449,7 @@ show(frame)
 #                      Connects the subclosets to the frame                   #
 ###############################################################################
 
-def create_rails():
+def load_rails():
     sub_rail = import_step("rail.stp")
 
     sub_rail_right = Part(sub_rail.children[0])
@@ -391,40 +458,48 @@ def create_rails():
     sub_rail_right = sub_rail_right.rotate(axis=Axis.X, angle=-90)
     sub_rail_left = sub_rail_left.rotate(axis=Axis.X, angle=-90)
 
-    return Compound(children=[
-        copy(sub_rail_left).transform_geometry(Matrix(
-            (
-                (0.1, 0, 0, 0),
-                (0, 0.06, 0, 0),
-                (0, 0, 0.1, 0),
-                (0, 0, 0, 1)
-            )
-        )).locate(
-            Location((
-                width / 2 - sub_depth / 2 + sub_back_offset - 2/3 * inner_margin - 22,
-                inner_depth + 32,
-                side_height
-            ))
-        ),
-        copy(sub_rail_right).transform_geometry(Matrix(
-            (
-                (0.1, 0, 0, 0),
-                (0, 0.06, 0, 0),
-                (0, 0, 0.1, 0),
-                (0, 0, 0, 1)
-            )
-        )).locate(
-            Location((
-                width / 2 + sub_depth / 2 - sub_back_offset + 2/3 * inner_margin,
-                inner_depth - 6,
-                side_height
-            ))
+    # Scaling the rails is slow, so it is done once and the scaled rails
+    # are only located when the parameters change
+    scale = Matrix(
+        (
+            (0.1, 0, 0, 0),
+            (0, 0.06, 0, 0),
+            (0, 0, 0.1, 0),
+            (0, 0, 0, 1)
         )
-    ])
+    )
+    return (
+        copy(sub_rail_left).transform_geometry(scale),
+        copy(sub_rail_right).transform_geometry(scale)
+    )
+
+def create_rails():
+    sub_rail_left, sub_rail_right = scaled_rails
 
-if not "rails" in globals():
-    global rails
-    rails = create_rails()
+    rail_left = copy(sub_rail_left).locate(
+        Location((
+            width / 2 - sub_depth / 2 + sub_back_offset - 2/3 * inner_margin - 22,
+            inner_depth + 32,
+            side_height
+        ))
+    )
+    rail_left.label = "Sub closet rail left"
+
+    rail_right = copy(sub_rail_right).locate(
+        Location((
+            width / 2 + sub_depth / 2 - sub_back_offset + 2/3 * inner_margin,
+            inner_depth - 6,
+            side_height
+        ))
+    )
+    rail_right.label = "Sub closet rail right"
+
+    return Compound(children=[rail_left, rail_right])
+
+if not "scaled_rails" in globals():
+    global scaled_rails
+    scaled_rails = load_rails()
+rails = create_rails()
 show(rails)
 
 # %%
@@ -437,7 +512,7 @@ with BuildPart() as bar_cylinder:
 with BuildPart() as bar_box:
     Box(plank_width, bar_width, bar_height - bar_width)
 
-bar = Part([
+bar = (
     copy(bar_cylinder.part) +
     copy(bar_cylinder.part).locate(
         Location((
@@ -453,7 +528,8 @@ bar = Part([
             bar_width / 2
         ))
     )
-])
+)
+bar.label = "Hanging bar"
 
 
 _, _, dress_y_left = get_plank_heights(pants_height_left)
@@ -464,7 +540,7 @@ bar_left = copy(bar).locate(
         inner_depth / 2,
         dress_y_left - offset - bar_height / 2 - bar_spacing - bar_width / 2
     ))
-),
+)
 
 _, _, dress_y_right = get_plank_heights(pants_height_right)
 
@@ -474,17 +550,17 @@ bar_right = copy(bar).locate(
         inner_depth / 2,
         dress_y_right - offset - bar_height / 2 - bar_spacing - bar_width / 2
     ))
-),
+)
 show(bar_left, bar_right)
 # %%
 ###############################################################################
 #                            HARDWARE ASSEMBLY                                #
 #                         Includes hangers and bars                           #
 ###############################################################################
-hardware = Compound([
+hardware = Compound(children=[
     rails,
-    Compound(bar_left),
-    Compound(bar_right)
+    bar_left,
+    bar_right
 ])
 hardware.color = Color(0.7, 0.7, 0.7)
 show(hardware)
@@ -502,8 +578,9 @@ with BuildPart() as door_wood:
 
 with BuildPart() as door_mirror:
     Box(door_width, mirror_thickness, height)
+    door_mirror.part.label = "Mirror"
 
-door = Compound([
+door = Compound(children=[
     copy(door_wood.part),
     copy(door_mirror.part).locate(
         Location((
@@ -524,7 +601,7 @@ door_left = copy(door).locate(
 door_left.color = Color(0.8, 0.8, 0.8)
 door_left.label = "Door"
 
-door_right = mirror(copy(door), about=Plane.YZ).locate(
+door_right = mirror_children(copy(door)).locate(
     Location((
         width - plank_horizontal_location,
         -thickness/2 - door_margin,
@@ -606,13 +683,13 @@ def create_planks(pants_height):
             ))
         ) for i in range(plank_count)
     ]
-    return Compound(plank_children)
+    return Compound(children=plank_children)
 
 
 planks_left = create_planks(pants_height_left)
 planks_left.color = Color(0.8, 0.7, 0.5)
 planks_right = create_planks(pants_height_right)
-planks_right = Part(mirror(planks_right, about=Plane.YZ))
+planks_right = mirror_children(planks_right)
 planks_right.color = Color(0.8, 0.7, 0.5)
 
 show(planks_left, planks_right)
@@ -727,7 +804,7 @@ sub_closet_left = create_sub_closet().locate(
     ))
 )
 
-sub_closet_right = mirror(create_sub_closet(), about=Plane.YZ).locate(
+sub_closet_right = mirror_children(create_sub_closet()).locate(
     Location((
         width / 2 + sub_depth - sub_back_offset + 2/3 * inner_margin,
         -depth - offset,
@@ -757,9 +834,226 @@ closet_children = [
     sub_closet_right,
     doors
 ]
-closet = Compound(closet_children)
+closet = Compound(children=closet_children, label="Closet")
+
+# The final assembly is shown through the viewer session, see VIEWER SESSION
+
+
+# %%
+###############################################################################
+#                             ASSEMBLY INDEX                                  #
+#          Walks an assembly once and indexes its leaves by label,            #
+#          category, material and parent sub-assemblies for queries           #
+###############################################################################
+_signature_cache = {}
+_digest_cache = {}
+
+
+def _digest(*values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def _rounded(values, digits=4):
+    # Adding 0.0 turns -0.0 into 0.0 so mirrored zeros hash the same
+    return tuple(round(value, digits) + 0.0 for value in values)
+
+
+def design_children(shape):
+    """Children of a shape in the assembly tree.
+
+    Assemblies built with children= keep their labels, compounds built from a
+    list of shapes only have their sub-shapes.
+    """
+    if shape.children:
+        return list(shape.children)
+    if isinstance(shape, Compound):
+        sub_shapes = list(shape)
+        if len(sub_shapes) > 1 or any(isinstance(sub, Compound) for sub in sub_shapes):
+            # Sub-shapes come with the location of shape applied, make them
+            # relative to shape like the children of an assembly
+            parent_inverse = shape.location.inverse()
+            for sub_shape in sub_shapes:
+                sub_shape.location = parent_inverse * sub_shape.location
+            return sub_shapes
+    return []
+
+
+def leaf_signature(shape):
+    """Location independent size of a leaf shape.
+
+    Returns the sorted bounding box dimensions in mm and the bounding box
+    center in the frame of the shape.
+
+    Located copies share their TShape, so the signature is computed once per
+    prototype.
+    """
+    key = shape.wrapped.TShape()
+    if key not in _signature_cache:
+        # The optimal box takes about a second per B-spline piece of the STEP
+        # rails. Their enclosing box is close enough for steel hardware, the
+        # sizes that classify panels and dowels come from analytic faces.
+        optimal = all(face.geom_type != GeomType.BSPLINE for face in shape.faces())
+        location = shape.location
+        shape.location = Location()
+        try:
+            bbox = shape.bounding_box(optimal=optimal)
+        finally:
+            shape.location = location
+        dims = sorted(_rounded((bbox.size.X * 10, bbox.size.Y * 10, bbox.size.Z * 10), 1))
+        _signature_cache[key] = (tuple(dims), bbox.center())
+    return _signature_cache[key]
+
+
+def leaf_digest(shape):
+    """Hash of the vertices of a leaf shape in its own frame.
+
+    Only needed to tell geometry apart, so it is not part of the index.
+    """
+    key = shape.wrapped.TShape()
+    if key not in _digest_cache:
+        location = shape.location
+        shape.location = Location()
+        try:
+            vertices = sorted(_rounded(vertex.to_tuple(), 3) for vertex in shape.vertices())
+        finally:
+            shape.location = location
+        _digest_cache[key] = _digest(vertices)
+    return _digest_cache[key]
+
+
+def leaf_material(dims):
+    """Material of a leaf from its sorted dimensions in mm."""
+    # Dowels are recognised by their size, labels get lost when mirroring
+    if any(
+        abs(dims[0] - diameter * 10) < 0.1
+        and abs(dims[1] - diameter * 10) < 0.1
+        and abs(dims[2] - length * 10) < 0.1
+        for diameter, length in METRIC_DOWEL_SIZES.values()
+    ):
+        return "dowel"
+    if abs(dims[0] - thickness * 10) < 0.1:
+        return "board"
+    if any(abs(dims[0] - t * 10) < 0.1 for t in [back_thickness, sub_back_thickness]):
+        return "back panel"
+    if abs(dims[0] - mirror_thickness * 10) < 0.1:
+        return "mirror"
+    return "steel"
+
+
+class AssemblyLeaf:
+    def __init__(self, path, shape, group, ancestors, location, color):
+        """A leaf of an assembly with everything the queries need.
+
+        Args:
+            path (str): Path of the leaf, built from labels or #<index>.
+            shape (Shape): The leaf shape.
+            group (str): Label of the top level group the leaf belongs to.
+            ancestors (tuple): Labels of the sub-assemblies around the leaf,
+                from the group down to its parent.
+            location (Location): Location of the leaf in the frame of its group.
+            color (Color): Color of the leaf or of its nearest colored ancestor.
+        """
+        self.path = path
+        self.shape = shape
+        self.label = shape.label
+        self.group = group
+        self.ancestors = ancestors
+        self.location = location
+        self.color = shape.color if shape.color is not None else color
+        self.dims, self.center = leaf_signature(shape)
+        self.material = leaf_material(self.dims)
+        if self.material == "mirror" or any(label.startswith("Door") for label in (group, *ancestors)):
+            self.category = "door"
+        elif self.material in ("steel", "dowel"):
+            self.category = "hardware"
+        else:
+            self.category = "wood"
+
+
+def iter_leaves(assembly):
+    """Stream the leaves of an assembly depth first, without recursion.
+
+    The top level children of the assembly are the groups, every leaf is
+    located in the frame of its group so poses that only move groups leave
+    the leaves untouched.
+    """
+    stack = []
+    for i, group in reversed(list(enumerate(design_children(assembly)))):
+        name = group.label or f"#{i}"
+        stack.append((group, name, name, (), Location(), group.color))
+
+    while stack:
+        shape, path, group, ancestors, location, color = stack.pop()
+        children = design_children(shape)
+        if not children:
+            yield AssemblyLeaf(path, shape, group, ancestors, location, color)
+            continue
+
+        ancestors = ancestors + (shape.label,)
+        color = shape.color if shape.color is not None else color
+        for i, child in reversed(list(enumerate(children))):
+            child_location = location * child.location
+            child_path = f"{path}/{child.label or f'#{i}'}"
+            stack.append((child, child_path, group, ancestors, child_location, color))
+
+
+class AssemblyIndex:
+    def __init__(self, assembly):
+        """Leaves of an assembly indexed by label, category, material and ancestors.
+
+        The assembly is walked once, queries then only touch the leaves in
+        their smallest matching index.
+        """
+        self.leaves = []
+        self.groups = {}
+        self._by_label = {}
+        self._by_category = {}
+        self._by_material = {}
+        self._within = {}
+
+        for leaf in iter_leaves(assembly):
+            position = len(self.leaves)
+            self.leaves.append(leaf)
+            self.groups.setdefault(leaf.group, []).append(leaf)
+            if leaf.label:
+                self._by_label.setdefault(leaf.label, set()).add(position)
+            self._by_category.setdefault(leaf.category, set()).add(position)
+            self._by_material.setdefault(leaf.material, set()).add(position)
+            for label in {leaf.group, *leaf.ancestors} - {""}:
+                self._within.setdefault(label, set()).add(position)
+
+    def query(self, label=None, category=None, material=None, within=None):
+        """Leaves matching all given criteria, in assembly order.
 
-show(closet_children)
+        Args:
+            label (str, optional): Label of the leaf.
+            category (str, optional): "wood", "hardware" or "door".
+            material (str, optional): Key into MATERIAL_DENSITIES.
+            within (str, optional): Label of a group or sub-assembly around the leaf.
+        """
+        criteria = [
+            index.get(value, set())
+            for index, value in [
+                (self._by_label, label),
+                (self._by_category, category),
+                (self._by_material, material),
+                (self._within, within),
+            ]
+            if value is not None
+        ]
+        if not criteria:
+            return list(self.leaves)
+
+        criteria.sort(key=len)
+        smallest, others = criteria[0], criteria[1:]
+        return [
+            self.leaves[position]
+            for position in sorted(smallest)
+            if all(position in other for other in others)
+        ]
+
+    def count(self, **criteria):
+        return len(self.query(**criteria))
 
 
 # %%
@@ -791,40 +1085,12 @@ class WoodPart:
 
 
 def flatten(part):
-    parts = []
-
-    if isinstance(part, Compound):
-        comps = part.children if len(part.children) else part.compounds()
-        for child in comps:
-            if child is not part:
-                parts.extend(flatten(child))
-            else:
-                # Get bounding box dimensions
-                bbox = part.bounding_box()
-                dims = [
-                    bbox.max.X - bbox.min.X,
-                    bbox.max.Y - bbox.min.Y,
-                    bbox.max.Z - bbox.min.Z
-                ]
-                dims = [d * 10 for d in dims]  # Convert to mm
-                dims.sort()
-                thickness = dims[0]
-
-                # Only include wooden parts that match known thicknesses
-                wood_thicknesses = [
-                    thickness * 10,
-                    back_thickness * 10,
-                    sub_back_thickness * 10
-                ]
-                if any(abs(d - t) < 0.1 
-                       for d in dims for t in wood_thicknesses):
-                    # Try to get name from part's label attribute if it exists
-                    name = getattr(part, "label", "")
-                    parts.append(WoodPart(dims[1], dims[2], thickness, name))
-    else:
-        print(f"Skipping part of type {type(part)}")
-
-    return parts
+    index = AssemblyIndex(part)
+    return [
+        WoodPart(leaf.dims[1], leaf.dims[2], leaf.dims[0], leaf.label)
+        for material in ["board", "back panel"]
+        for leaf in index.query(material=material)
+    ]
 
 
 def export_wood_parts(part):
@@ -860,7 +1126,1935 @@ def export_wood_parts(part):
 
 
 # Call the function on the closet
-export_wood_parts(closet)
+if not headless:
+    export_wood_parts(closet)
+
+
+# %%
+###############################################################################
+#                          OPEN/CLOSE ANIMATION                               #
+#           Poses the sub closets and doors by updating locations only        #
+#                   and streams the motion to the viewer                      #
+###############################################################################
+door_open_angle = 100.0
+
+
+class SlideJoint:
+    def __init__(self, rest, direction):
+        """Slide a sub-assembly along a rail.
+
+        Args:
+            rest (Location): Location of the sub-assembly when closed.
+            direction (Vector): Unit vector to slide along when opening.
+        """
+        self.rest = rest
+        self.direction = direction
+
+    def location(self, travel):
+        return Location(self.direction * travel) * self.rest
+
+    def track(self, values):
+        return "t", [list((self.direction * travel).to_tuple()) for travel in values]
+
+
+class HingeJoint:
+    def __init__(self, hinge, sign):
+        """Swing a sub-assembly around a vertical hinge.
+
+        Args:
+            hinge (Location): Location of the hinge axis, the sub-assembly origin.
+            sign (int): 1 to open counter clockwise, -1 to open clockwise.
+        """
+        self.rest = hinge
+        self.sign = sign
+
+    def location(self, angle):
+        return self.rest * Location((0, 0, 0), (0, 0, self.sign * angle))
+
+    def track(self, values):
+        return "rz", [self.sign * angle for angle in values]
+
+
+def make_closet_joints():
+    """Create the joints of the moving groups, keyed by group label."""
+    sub_right_closed = Location((
+        sub_closet_right.location.position.X,
+        sub_closet_left.location.position.Y,
+        sub_closet_right.location.position.Z
+    ))
+    hinge_y = -door_margin - door_thickness
+    hinge_left = Location((door_left.location.position.X - door_width / 2, hinge_y, 0))
+    hinge_right = Location((door_right.location.position.X + door_width / 2, hinge_y, 0))
+
+    return {
+        "Sub closet left": SlideJoint(sub_closet_left.location, Vector(0, -1, 0)),
+        "Sub closet right": SlideJoint(sub_right_closed, Vector(0, -1, 0)),
+        "Door left": HingeJoint(hinge_left, -1),
+        "Door right": HingeJoint(hinge_right, 1),
+    }
+
+
+def make_posable_closet():
+    """Assemble the closet with its moving parts in their own groups.
+
+    The sub closets are located at their closed position and the doors get
+    their origin on the hinge axis, so a pose only has to change the location
+    of a group. The geometry, and with it the tessellation, is shared.
+    """
+    posable_children = []
+    for label, part in [
+        ("Frame", frame),
+        ("Hardware", hardware),
+        ("Planks left", planks_left),
+        ("Planks right", planks_right),
+    ]:
+        posable_part = copy(part)
+        posable_part.label = label
+        posable_children.append(posable_part)
+
+    hinge_left = closet_joints["Door left"].rest
+    hinge_right = closet_joints["Door right"].rest
+    posable_door_left = copy(door).locate(hinge_left.inverse() * door_left.location)
+    posable_door_right = mirror_children(copy(door)).locate(
+        hinge_right.inverse() * door_right.location
+    )
+    posable_door_left.color = door_left.color
+    posable_door_right.color = door_right.color
+
+    posable_children += [
+        Compound(children=[copy(sub_closet_left).locate(Location())], label="Sub closet left"),
+        Compound(children=[copy(sub_closet_right).locate(Location())], label="Sub closet right"),
+        Compound(children=[posable_door_left], label="Door left"),
+        Compound(children=[posable_door_right], label="Door right"),
+    ]
+    return apply_pose(Compound(children=posable_children, label="Closet"), CLOSED_POSE)
+
+
+CLOSED_POSE = {
+    "Sub closet left": 0.0,
+    "Sub closet right": 0.0,
+    "Door left": 0.0,
+    "Door right": 0.0,
+}
+
+OPEN_POSE = {
+    "Sub closet left": open_sub_depth,
+    "Sub closet right": open_sub_depth,
+    "Door left": door_open_angle,
+    "Door right": door_open_angle,
+}
+
+
+def apply_pose(posable, pose):
+    """Move the groups of a posable closet to a pose, without rebuilding.
+
+    Args:
+        posable (Compound): Closet created by make_posable_closet().
+        pose (dict): Slide travel (cm) or door angle (degrees) per group label.
+    """
+    for child in posable.children:
+        if child.label in pose:
+            child.location = closet_joints[child.label].location(pose[child.label])
+    # Reattach the groups so the compound picks up their new locations
+    posable.children = list(posable.children)
+    return posable
+
+
+def interpolate_pose(keyframes, time):
+    """Linearly interpolate a pose from a list of (time, pose) keyframes."""
+    if time <= keyframes[0][0]:
+        return dict(keyframes[0][1])
+    for (start, start_pose), (end, end_pose) in zip(keyframes, keyframes[1:]):
+        if time <= end:
+            factor = (time - start) / (end - start) if end > start else 1.0
+            return {
+                label: start_pose.get(label, 0.0)
+                + (end_pose.get(label, 0.0) - start_pose.get(label, 0.0)) * factor
+                for label in closet_joints
+            }
+    return dict(keyframes[-1][1])
+
+
+def animate_closet(posable, keyframes, frames=60, speed=1.0):
+    """Show the posable closet once and animate it through the keyframes.
+
+    Only the animation tracks, the per frame group transforms, are sent
+    after the initial display.
+    """
+    duration = keyframes[-1][0] - keyframes[0][0]
+    times = [duration * i / max(1, frames - 1) for i in range(frames)]
+    poses = [interpolate_pose(keyframes, keyframes[0][0] + time) for time in times]
+
+    show(apply_pose(posable, CLOSED_POSE))
+    animation = Animation(posable)
+    for label, joint in closet_joints.items():
+        action, values = joint.track([pose[label] for pose in poses])
+        animation.add_track(f"/{posable.label}/{label}", action, times, values)
+    animation.animate(speed)
+    return animation
+
+
+closet_joints = make_closet_joints()
+
+open_close_keyframes = [
+    (0.0, CLOSED_POSE),
+    (1.0, OPEN_POSE),
+    (2.0, CLOSED_POSE),
+]
+
+posable_closet = make_posable_closet()
+if not headless:
+    animate_closet(posable_closet, open_close_keyframes)
+
+
+# %%
+###############################################################################
+#                              DESIGN DIFF                                    #
+#          Hashes every node of the closet assembly (Merkle tree) and         #
+#        reports only the changed subtrees between two design revisions       #
+###############################################################################
+DESIGN_PARAMETERS = [
+    "thickness", "back_thickness", "width", "height", "depth_budget",
+    "mirror_thickness", "sub_depth", "inner_margin", "wheel_height",
+    "rail_height", "sub_back_thickness", "bottom_height", "pants_width",
+    "dress_height", "bar_height", "bar_width", "bar_spacing",
+    "pants_height_left", "pants_height_right", "door_margin", "dowel_size",
+]
+
+class DesignNode:
+    def __init__(self, label, placement, content, children=(), wood=None):
+        """A node of the design tree with a content hash of its subtree.
+
+        Args:
+            label (str): Key of the node among its siblings.
+            placement (tuple): Rounded position and orientation of the node.
+            content (str): Hash of the parameter value or geometry of a leaf,
+                or of the digests of the children.
+            children (list): Child DesignNodes.
+            wood (tuple, optional): (width, height, thickness, name) in mm when
+                the node is a wooden panel.
+        """
+        self.label = label
+        self.placement = tuple(placement)
+        self.content = content
+        self.digest = _digest(label, self.placement, content)
+        self.children = list(children)
+        self.wood = wood
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "placement": self.placement,
+            "content": self.content,
+            "wood": self.wood,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        wood = tuple(data["wood"]) if data["wood"] else None
+        children = [cls.from_dict(child) for child in data["children"]]
+        return cls(data["label"], data["placement"], data["content"], children, wood)
+
+
+def wood_dimensions(dims, name):
+    """Cut list row for a leaf with sorted dimensions in mm, None if not wood."""
+    wood_thicknesses = [thickness * 10, back_thickness * 10, sub_back_thickness * 10]
+    if any(abs(dims[0] - t) < 0.1 for t in wood_thicknesses):
+        part = WoodPart(dims[1], dims[2], dims[0], name)
+        return (part.width, part.height, part.thickness, name)
+    return None
+
+
+def make_design_tree(shape, label=None):
+    """Build the hashed design tree of a shape and its children."""
+    label = label if label is not None else shape.label
+    location = shape.location
+    placement = _rounded(location.position.to_tuple()) + _rounded(location.orientation.to_tuple())
+
+    sub_shapes = design_children(shape)
+    if not sub_shapes:
+        dims, _ = leaf_signature(shape)
+        return DesignNode(
+            label,
+            placement,
+            _digest(dims, leaf_digest(shape)),
+            wood=wood_dimensions(dims, shape.label),
+        )
+
+    seen = Counter()
+    children = []
+    for i, sub_shape in enumerate(sub_shapes):
+        if sub_shape.label:
+            child_label = f"{sub_shape.label}[{seen[sub_shape.label]}]"
+            seen[sub_shape.label] += 1
+        else:
+            child_label = f"#{i}"
+        children.append(make_design_tree(sub_shape, child_label))
+    return DesignNode(label, placement, _digest([child.digest for child in children]), children)
+
+
+def make_parameters_tree():
+    children = [
+        DesignNode(name, (), _digest(globals()[name]))
+        for name in DESIGN_PARAMETERS
+    ]
+    return DesignNode("Parameters", (), _digest([child.digest for child in children]), children)
+
+
+def make_closet_design(posable):
+    """Design tree of a posable closet, including the global parameters."""
+    children = [make_parameters_tree()] + [
+        make_design_tree(child) for child in posable.children
+    ]
+    return DesignNode(posable.label, (), _digest([child.digest for child in children]), children)
+
+
+def save_design(design, path):
+    with open(path, "w") as f:
+        json.dump(design.to_dict(), f)
+
+
+def load_design(path):
+    with open(path) as f:
+        return DesignNode.from_dict(json.load(f))
+
+
+def diff_designs(old, new, path=""):
+    """Yield (change, path, old_node, new_node) for every changed subtree.
+
+    Subtrees with equal digests are skipped without being visited, so the
+    walk only touches the changed part of the design. Groups of unlabeled
+    leaves, like the dowels between two panels, are reported as a whole.
+    A node that only got a new location is reported as moved.
+    """
+    path = f"{path}/{new.label}" if path else new.label
+    if old.digest == new.digest:
+        return
+    if old.placement != new.placement:
+        yield "moved", path, old, new
+    if old.content == new.content:
+        return
+    is_group = all(
+        not child.children and child.label.startswith("#")
+        for child in old.children + new.children
+    )
+    if not old.children or not new.children or is_group:
+        yield "changed", path, old, new
+        return
+
+    old_children = {child.label: child for child in old.children}
+    new_children = {child.label: child for child in new.children}
+    for label, child in old_children.items():
+        if label not in new_children:
+            yield "removed", f"{path}/{label}", child, None
+    for label, child in new_children.items():
+        if label not in old_children:
+            yield "added", f"{path}/{label}", None, child
+        else:
+            yield from diff_designs(old_children[label], child, path)
+
+
+def design_wood(node):
+    if node is None:
+        return
+    if node.wood:
+        yield node.wood
+    for child in node.children:
+        yield from design_wood(child)
+
+
+def cut_list_delta(changes):
+    """Difference in wood parts, keyed by (width, height, thickness) in mm."""
+    delta = Counter()
+    names = {}
+    for change, _, old, new in changes:
+        if change == "moved":
+            continue
+        for width, height, thickness, name in design_wood(old):
+            delta[(width, height, thickness)] -= 1
+            names.setdefault((width, height, thickness), name)
+        for width, height, thickness, name in design_wood(new):
+            delta[(width, height, thickness)] += 1
+            names.setdefault((width, height, thickness), name)
+    return {dims: (count, names[dims]) for dims, count in delta.items() if count}
+
+
+def print_design_diff(old, new):
+    changes = list(diff_designs(old, new))
+
+    print("\nDesign changes:")
+    print("---------------")
+    for change, path, _, _ in changes:
+        print(f"{change.ljust(7)} {path}")
+    if not changes:
+        print("no changes")
+
+    print("\nCut list delta (dimensions in mm):")
+    print("----------------------------------")
+    for (width, height, thickness), (count, name) in sorted(cut_list_delta(changes).items()):
+        print(f"{count:+3d} * {width:.1f}x{height:.1f} (thickness: {thickness:.1f}mm) - {name}")
+    return changes
+
+
+# Compare against the design of the previous run, then store this revision
+design_path = "closet_design.json"
+if not headless:
+    closet_design = make_closet_design(apply_pose(posable_closet, CLOSED_POSE))
+    if os.path.exists(design_path):
+        print_design_diff(load_design(design_path), closet_design)
+    save_design(closet_design, design_path)
+
+
+# %%
+###############################################################################
+#                            MASS PROPERTIES                                  #
+#           Weights, center of gravity and tip-over check per pose,           #
+#                 computed from the panel dimensions and placements           #
+###############################################################################
+_prototype_mass_cache = {}
+
+
+class MassPart:
+    def __init__(self, path, material, mass, center):
+        """A leaf of the closet with its mass.
+
+        Args:
+            path (str): Path of the part in the posable closet.
+            material (str): Key into MATERIAL_DENSITIES.
+            mass (float): Mass in kg.
+            center (Vector): Center of gravity in the frame of its top level group.
+        """
+        self.path = path
+        self.material = material
+        self.mass = mass
+        self.center = center
+
+
+def prototype_volume(shape):
+    """Volume (cm³) and center of a non panel leaf, computed once per geometry.
+
+    Mirrored parts, like the dowels of the right planks, do not share a
+    TShape with the originals, so the cache is keyed on the dimensions and
+    vertex hash of the leaf.
+    """
+    key = (leaf_signature(shape)[0], leaf_digest(shape))
+    if key not in _prototype_mass_cache:
+        location = shape.location
+        shape.location = Location()
+        try:
+            _prototype_mass_cache[key] = (shape.volume, shape.center())
+        finally:
+            shape.location = location
+    return _prototype_mass_cache[key]
+
+
+def _mass_part(leaf):
+    if leaf.material == "steel" or leaf.material == "dowel":
+        volume, center = prototype_volume(leaf.shape)
+    else:
+        # Panels are boxes, their volume follows from the dimensions
+        volume = leaf.dims[0] * leaf.dims[1] * leaf.dims[2] / 1000
+        center = leaf.center
+    mass = volume * MATERIAL_DENSITIES[leaf.material] / 1000
+    return MassPart(leaf.path, leaf.material, mass, (leaf.location * Location(center)).position)
+
+
+def make_mass_registry(posable, index=None):
+    """Mass parts of a posable closet, grouped by top level group label.
+
+    Centers are stored in the frame of their group, so a pose only has to
+    move the group totals.
+    """
+    index = index or AssemblyIndex(posable)
+    return {
+        group: [_mass_part(leaf) for leaf in leaves]
+        for group, leaves in index.groups.items()
+    }
+
+
+def mass_properties(posable, registry, pose):
+    """Total mass (kg) and center of gravity of the closet in a pose.
+
+    The posable itself is not moved, the group locations of the pose are
+    taken from the closet joints.
+    """
+    total_mass = 0.0
+    moment = Vector(0, 0, 0)
+    for group in posable.children:
+        location = group.location
+        if group.label in closet_joints and group.label in pose:
+            location = closet_joints[group.label].location(pose[group.label])
+        parts = registry[group.label]
+        group_mass = sum(part.mass for part in parts)
+        if not group_mass:
+            continue
+        group_moment = sum((part.center * part.mass for part in parts), Vector(0, 0, 0))
+        total_mass += group_mass
+        moment += (location * Location(group_moment / group_mass)).position * group_mass
+    return total_mass, moment / total_mass
+
+
+def tip_over_margin(center_of_gravity):
+    """Distance (cm) from the center of gravity to the nearest edge of the footprint.
+
+    The closet stands on the frame, from 0 to width and from the front (0)
+    to the back (depth). A negative margin means the closet tips over.
+    """
+    return min(
+        center_of_gravity.X,
+        width - center_of_gravity.X,
+        center_of_gravity.Y,
+        depth - center_of_gravity.Y,
+    )
+
+
+def cross_check_mass(posable, registry, index=None):
+    """Compare the registry masses with OCC volumes of every leaf. Slow."""
+    index = index or AssemblyIndex(posable)
+    occ_mass = sum(
+        leaf.shape.volume * MATERIAL_DENSITIES[leaf.material] / 1000
+        for leaf in index.leaves
+    )
+    registry_mass = sum(part.mass for parts in registry.values() for part in parts)
+    print(f"Registry mass: {registry_mass:.2f}kg, OCC mass: {occ_mass:.2f}kg")
+    return registry_mass, occ_mass
+
+
+def print_mass_properties(posable, registry, poses):
+    material_masses = Counter()
+    group_masses = Counter()
+    for label, parts in registry.items():
+        for part in parts:
+            material_masses[part.material] += part.mass
+            group_masses[label] += part.mass
+
+    print("\nMass per material:")
+    print("------------------")
+    for material, mass in material_masses.most_common():
+        print(f"{mass:7.2f}kg - {material}")
+
+    print("\nMass per group:")
+    print("---------------")
+    for label, mass in group_masses.most_common():
+        print(f"{mass:7.2f}kg - {label}")
+
+    print("\nCenter of gravity and tip-over check:")
+    print("-------------------------------------")
+    for name, pose in poses.items():
+        total_mass, center = mass_properties(posable, registry, pose)
+        margin = tip_over_margin(center)
+        status = "stable" if margin > 0 else "TIPS OVER"
+        print(
+            f"{name}: {total_mass:.2f}kg at ({center.X:.1f}, {center.Y:.1f}, {center.Z:.1f}), "
+            f"margin {margin:.1f}cm - {status}"
+        )
+
+
+if not headless:
+    mass_registry = make_mass_registry(apply_pose(posable_closet, CLOSED_POSE))
+    print_mass_properties(posable_closet, mass_registry, {"Closed": CLOSED_POSE, "Open": OPEN_POSE})
+
+
+# %%
+###############################################################################
+#                            VIEWER SESSION                                   #
+#         Remembers what was sent to the viewer and only sends updates        #
+#                      for the parts of the design that changed               #
+###############################################################################
+class ViewerSession:
+    def __init__(self):
+        """Keep track of the assembly shown in the viewer.
+
+        The viewer protocol can only replace the whole model, or animate the
+        groups of the model that is shown. So an update that only relocates
+        top level groups is sent as transform tracks, without tessellating or
+        sending any geometry. Any other change sends the model again.
+        """
+        self.shown = None
+        self.current = None
+
+    def update(self, assembly):
+        """Bring the viewer up to date with assembly.
+
+        Returns:
+            str: "unchanged", "relocated" or "shown".
+        """
+        design = make_design_tree(assembly)
+        if self.current is not None and self.current.digest == design.digest:
+            return "unchanged"
+
+        changes = None
+        if self.shown is not None and self.shown.label == design.label:
+            changes = list(diff_designs(self.shown, design))
+        if changes is not None and self._relocate(assembly, design, changes):
+            self.current = design
+            return "relocated"
+
+        show(assembly, reset_camera=Camera.KEEP)
+        self.shown = design
+        self.current = design
+        return "shown"
+
+    def _relocate(self, assembly, design, changes):
+        labels = Counter(child.label.rsplit("[", 1)[0] for child in design.children)
+        moves = []
+        for change, path, old, new in changes:
+            label = new.label.rsplit("[", 1)[0] if new else None
+            if change != "moved" or path != f"{design.label}/{new.label}" or labels[label] != 1:
+                return False
+            moves.append((label, old, new))
+
+        animation = Animation(assembly)
+        for label, old, new in moves:
+            old_location = Location(old.placement[:3], old.placement[3:])
+            new_location = Location(new.placement[:3], new.placement[3:])
+            # The viewer adds the translation to the shown position and
+            # multiplies the shown rotation with the quaternion
+            translation = list((new_location.position - old_location.position).to_tuple())
+            rotation = (old_location.inverse() * new_location).wrapped.Transformation().GetRotation()
+            quaternion = [rotation.X(), rotation.Y(), rotation.Z(), rotation.W()]
+            animation.add_track(f"/{assembly.label}/{label}", "t", [0, 1], [translation, translation])
+            animation.add_track(f"/{assembly.label}/{label}", "q", [0, 1], [quaternion, quaternion])
+        animation.animate(1)
+        return True
+
+
+if not headless:
+    # The final assembly goes through the session, so showing it in another
+    # pose only sends the moved groups. Cells that call show() directly
+    # replace the model behind the session's back, so create the session
+    # after them.
+    viewer_session = ViewerSession()
+    viewer_session.update(apply_pose(posable_closet, CLOSED_POSE))
+    viewer_session.update(apply_pose(posable_closet, OPEN_POSE))
+
+
+# %%
+###############################################################################
+#                          OFFSCREEN RENDERING                                #
+#         Renders PNG images of the closet in software, without a viewer      #
+#                 or GPU, reusing one tessellation per prototype              #
+###############################################################################
+_mesh_cache = {}
+
+default_render_color = Color(0.8, 0.7, 0.5)
+
+RENDER_VIEWS = {
+    # View name: (pose, view direction, explode factor)
+    "front": (CLOSED_POSE, (0, 1, 0), 0.0),
+    "open-doors": (OPEN_POSE, (0.6, 1, -0.35), 0.0),
+    "exploded": (CLOSED_POSE, (0.6, 1, -0.35), 0.4),
+}
+
+
+def prototype_mesh(shape, tolerance=0.1, angular_tolerance=0.3):
+    """Vertices and triangles of a leaf in its own frame, tessellated once per TShape."""
+    key = shape.wrapped.TShape()
+    if key not in _mesh_cache:
+        location = shape.location
+        shape.location = Location()
+        try:
+            vertices, triangles = shape.tessellate(tolerance, angular_tolerance)
+        finally:
+            shape.location = location
+        _mesh_cache[key] = (
+            np.array([v.to_tuple() for v in vertices], dtype=float).reshape(-1, 3),
+            np.array(triangles, dtype=int).reshape(-1, 3),
+        )
+    return _mesh_cache[key]
+
+
+def location_matrix(location):
+    """The 3x4 transformation matrix of a Location."""
+    transformation = location.wrapped.Transformation()
+    return np.array([
+        [transformation.Value(row, column) for column in range(1, 5)]
+        for row in range(1, 4)
+    ])
+
+
+def closet_meshes(posable, explode=0.0, index=None):
+    """World space meshes of a posable closet, grouped by top level group.
+
+    With explode > 0 every group is moved away from the center of the closet
+    by that fraction of its distance to the center. An index of the posable
+    can be passed in to reuse it between poses.
+    """
+    index = index or AssemblyIndex(posable)
+    group_locations = {
+        group.label or f"#{i}": group.location
+        for i, group in enumerate(design_children(posable))
+    }
+    groups = []
+    for group, leaves in index.groups.items():
+        meshes = []
+        for leaf in leaves:
+            vertices, triangles = prototype_mesh(leaf.shape)
+            if len(triangles):
+                matrix = location_matrix(group_locations[group] * leaf.location)
+                color = leaf.color if leaf.color is not None else default_render_color
+                meshes.append((vertices @ matrix[:, :3].T + matrix[:, 3], triangles, color))
+        if meshes:
+            groups.append(meshes)
+
+    if explode:
+        centers = [
+            np.concatenate([vertices for vertices, _, _ in meshes]).mean(axis=0)
+            for meshes in groups
+        ]
+        closet_center = np.mean(centers, axis=0)
+        groups = [
+            [(vertices + (center - closet_center) * explode, triangles, color)
+             for vertices, triangles, color in meshes]
+            for meshes, center in zip(groups, centers)
+        ]
+    return [mesh for meshes in groups for mesh in meshes]
+
+
+def render_meshes(meshes, direction, size=(480, 640), margin=16, background=255):
+    """Rasterize meshes with a z-buffer in an orthographic view.
+
+    Args:
+        meshes (list): (vertices, triangles, color) tuples in world space.
+        direction (tuple): Direction the camera looks in, Z is up.
+        size (tuple): Image width and height in pixels.
+
+    Returns:
+        numpy.ndarray: RGB image of shape (height, width, 3).
+    """
+    width_px, height_px = size
+    forward = np.array(direction, dtype=float)
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, (0, 0, 1))
+    right /= np.linalg.norm(right)
+    up = np.cross(right, forward)
+    light = -forward + up * 0.5 - right * 0.3
+    light /= np.linalg.norm(light)
+
+    vertices = np.concatenate([v for v, _, _ in meshes])
+    camera = np.stack([vertices @ right, vertices @ up, vertices @ forward], axis=1)
+    low, high = camera[:, :2].min(axis=0), camera[:, :2].max(axis=0)
+    scale = min((width_px - 2 * margin) / (high[0] - low[0]), (height_px - 2 * margin) / (high[1] - low[1]))
+    shift = (np.array([width_px, height_px]) - (high - low) * scale) / 2
+
+    screen = np.empty_like(camera)
+    screen[:, 0] = (camera[:, 0] - low[0]) * scale + shift[0]
+    screen[:, 1] = height_px - ((camera[:, 1] - low[1]) * scale + shift[1])
+    screen[:, 2] = camera[:, 2]
+
+    offsets = np.cumsum([0] + [len(v) for v, _, _ in meshes[:-1]])
+    triangles = np.concatenate([t + o for (_, t, _), o in zip(meshes, offsets)])
+    colors = np.concatenate([
+        np.tile(np.array(color.to_tuple()[:3]) * 255, (len(t), 1)) for _, t, color in meshes
+    ])
+
+    world = vertices[triangles]
+    normals = np.cross(world[:, 1] - world[:, 0], world[:, 2] - world[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    normals[lengths > 0] /= lengths[lengths > 0, None]
+    colors = (colors * (0.35 + 0.65 * np.abs(normals @ light))[:, None]).astype(np.uint8)
+
+    image = np.full((height_px, width_px, 3), background, dtype=np.uint8)
+    depth_buffer = np.full((height_px, width_px), np.inf)
+
+    corners = screen[triangles]
+    spans = corners[:, :, :2].max(axis=1) - corners[:, :, :2].min(axis=1)
+    small = (spans < 2).all(axis=1)
+    for triangle, rgb in zip(corners[~small], colors[~small]):
+        _fill_triangle(image, depth_buffer, triangle, rgb)
+
+    # Triangles of about a pixel, like those of the dowels and rails, are
+    # drawn as single pixels at once, far to near so the nearest one wins
+    centers = corners[small].mean(axis=1)
+    xs = np.clip(centers[:, 0].astype(int), 0, width_px - 1)
+    ys = np.clip(centers[:, 1].astype(int), 0, height_px - 1)
+    depths = centers[:, 2]
+    visible = depths < depth_buffer[ys, xs]
+    order = np.argsort(-depths[visible])
+    xs, ys, depths = xs[visible][order], ys[visible][order], depths[visible][order]
+    image[ys, xs] = colors[small][visible][order]
+    np.minimum.at(depth_buffer, (ys, xs), depths)
+    return image
+
+
+def _fill_triangle(image, depth_buffer, triangle, rgb):
+    height_px, width_px = depth_buffer.shape
+    x0, y0 = np.floor(triangle[:, :2].min(axis=0)).astype(int)
+    x1, y1 = np.ceil(triangle[:, :2].max(axis=0)).astype(int)
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, width_px - 1), min(y1, height_px - 1)
+    if x0 > x1 or y0 > y1:
+        return
+
+    (ax, ay, az), (bx, by, bz), (cx, cy, cz) = triangle
+    area = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    if abs(area) < 1e-9:
+        return
+    xs, ys = np.meshgrid(np.arange(x0, x1 + 1) + 0.5, np.arange(y0, y1 + 1) + 0.5)
+    w0 = ((bx - xs) * (cy - ys) - (by - ys) * (cx - xs)) / area
+    w1 = ((cx - xs) * (ay - ys) - (cy - ys) * (ax - xs)) / area
+    w2 = 1 - w0 - w1
+    inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+    depth = w0 * az + w1 * bz + w2 * cz
+    window = depth_buffer[y0:y1 + 1, x0:x1 + 1]
+    visible = inside & (depth < window)
+    window[visible] = depth[visible]
+    image[y0:y1 + 1, x0:x1 + 1][visible] = rgb
+
+
+def write_png(path, image):
+    """Write an RGB uint8 image as PNG, using only the standard library."""
+    height_px, width_px, _ = image.shape
+    raw = b"".join(b"\x00" + row.tobytes() for row in image)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width_px, height_px, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def render_views(posable, name, output_dir, views=RENDER_VIEWS, size=(480, 640)):
+    """Render the views of a posable closet to <output_dir>/<name>-<view>.png."""
+    os.makedirs(output_dir, exist_ok=True)
+    index = AssemblyIndex(posable)
+    images = {}
+    for view, (pose, direction, explode) in views.items():
+        meshes = closet_meshes(apply_pose(posable, pose), explode, index)
+        filename = f"{name}-{view}.png"
+        write_png(os.path.join(output_dir, filename), render_meshes(meshes, direction, size))
+        images[view] = filename
+    apply_pose(posable, CLOSED_POSE)
+    return images
+
+
+if not headless:
+    render_views(posable_closet, "closet", "renders")
+
+
+# %%
+###############################################################################
+#                              ORDER STORE                                    #
+#        Appends the cut list, dowel counts and hardware of every build       #
+#           to memory-mapped column files for analytics over orders           #
+###############################################################################
+ORDER_TABLES = {
+    # Table: [(column, dtype)], category columns store int32 codes
+    "orders": [
+        ("order", "int64"),
+        ("timestamp", "int64"),
+        ("variant", "category"),
+        ("width", "float32"),
+        ("depth", "float32"),
+        ("height", "float32"),
+        ("panels", "int32"),
+        ("dowels", "int32"),
+        ("holes", "int32"),
+    ],
+    "cut_list": [
+        ("order", "int64"),
+        ("timestamp", "int64"),
+        ("material", "category"),
+        ("name", "category"),
+        ("thickness", "float32"),
+        ("width", "float32"),
+        ("height", "float32"),
+        ("count", "int32"),
+        ("area", "float32"),
+    ],
+    "hardware": [
+        ("order", "int64"),
+        ("timestamp", "int64"),
+        ("item", "category"),
+        ("material", "category"),
+        ("count", "int32"),
+    ],
+}
+
+
+class OrderStore:
+    def __init__(self, path):
+        """Columnar store of orders in a directory.
+
+        Every column of a table is a flat binary file that is appended to and
+        read back as a memory map. <table>.json holds the number of complete
+        rows and the values of the category columns. Several instances and
+        processes can use the same directory, appends are locked and the
+        row counts are re-read.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._meta = {}
+        self._codes = {}
+        self._lock_depth = 0
+        for table in ORDER_TABLES:
+            self._reload(table)
+
+    def _reload(self, table):
+        self._meta[table] = meta = self._load_meta(table)
+        self._codes[table] = {
+            column: {value: code for code, value in enumerate(values)}
+            for column, values in meta["categories"].items()
+        }
+
+    def _load_meta(self, table):
+        path = os.path.join(self.path, f"{table}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {
+            "rows": 0,
+            "categories": {
+                column: [] for column, dtype in ORDER_TABLES[table] if dtype == "category"
+            },
+        }
+
+    def _dtype(self, table, column):
+        dtype = dict(ORDER_TABLES[table])[column]
+        return np.dtype("int32" if dtype == "category" else dtype)
+
+    def _column_path(self, table, column):
+        return os.path.join(self.path, f"{table}.{column}.bin")
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the store directory, can be nested."""
+        if self._lock_depth or fcntl is None:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            yield
+        finally:
+            self._lock_depth = 0
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def rows(self, table):
+        """Number of complete rows, as last written by any instance."""
+        self._reload(table)
+        return self._meta[table]["rows"]
+
+    def append(self, table, rows):
+        """Append rows, given as dicts of column values, to a table."""
+        if not rows:
+            return
+        with self.lock():
+            # Another instance may have appended since this one last looked
+            self._reload(table)
+            self._append(table, rows)
+
+    def _append(self, table, rows):
+        meta = self._meta[table]
+        for column, dtype in ORDER_TABLES[table]:
+            values = [row[column] for row in rows]
+            if dtype == "category":
+                codes = self._codes[table][column]
+                for value in values:
+                    if value not in codes:
+                        codes[value] = len(codes)
+                        meta["categories"][column].append(value)
+                values = [codes[value] for value in values]
+            array = np.asarray(values, dtype=self._dtype(table, column))
+            with open(self._column_path(table, column), "ab") as f:
+                # Drop the tail of an append that did not complete
+                f.truncate(meta["rows"] * array.itemsize)
+                f.write(array.tobytes())
+
+        # The row count is only updated once every column is written
+        meta["rows"] += len(rows)
+        path = os.path.join(self.path, f"{table}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def column(self, table, column):
+        """Memory-mapped values of a column, category columns as their codes."""
+        return self._column(table, column, self.rows(table))
+
+    def _column(self, table, column, rows):
+        dtype = self._dtype(table, column)
+        if not rows:
+            return np.empty(0, dtype)
+        return np.memmap(self._column_path(table, column), dtype=dtype, mode="r", shape=(rows,))
+
+    def categories(self, table, column):
+        self._reload(table)
+        return list(self._meta[table]["categories"][column])
+
+    def where(self, table, since=None, until=None, **filters):
+        """Boolean mask of the rows matching a time range and column values.
+
+        Args:
+            since (float, optional): First timestamp (seconds since the epoch).
+            until (float, optional): Timestamp after the last row.
+            **filters: Value per column, strings for category columns.
+        """
+        # Read the row count once, so every column has the same length
+        rows = self.rows(table)
+        mask = np.ones(rows, dtype=bool)
+        if since is not None:
+            mask &= self._column(table, "timestamp", rows) >= since
+        if until is not None:
+            mask &= self._column(table, "timestamp", rows) < until
+        for column, value in filters.items():
+            if column in self._codes[table]:
+                value = self._codes[table][column].get(value, -1)
+            mask &= self._column(table, column, rows) == np.asarray(value, self._dtype(table, column))
+        return mask
+
+    def total(self, table, value=None, by=None, since=None, until=None, **filters):
+        """Sum of a column over the matching rows, or the number of rows.
+
+        Args:
+            value (str, optional): Column to sum, rows are counted when None.
+            by (str, optional): Column to group by, returns {group: total}.
+            since, until, **filters: See where().
+        """
+        mask = self.where(table, since, until, **filters)
+        rows = len(mask)
+        weights = self._column(table, value, rows)[mask].astype(float) if value else None
+        if by is None:
+            return float(weights.sum()) if value else int(mask.sum())
+
+        keys = self._column(table, by, rows)[mask]
+        if by in self._codes[table]:
+            # Categories only grow, the codes of these rows are all known
+            groups, inverse = list(self._meta[table]["categories"][by]), keys
+        else:
+            groups, inverse = np.unique(keys, return_inverse=True)
+            groups = groups.tolist()
+        totals = np.bincount(inverse, weights=weights, minlength=len(groups))
+        return {group: total for group, total in zip(groups, totals.tolist()) if total}
+
+
+def hardware_items(index):
+    """Count of every hardware item of an indexed closet by (item, material).
+
+    Hardware is named after the nearest label on its path, so a part made of
+    several solids, like a STEP rail, counts once. The dowels lose their
+    labels in the compounds they are placed in and are named by their size.
+    """
+    items = Counter()
+    parts = set()
+    for leaf in index.query(category="hardware"):
+        if leaf.label or leaf.material == "dowel":
+            item = leaf.label or f"Dowel {leaf.dims[0]:g}x{leaf.dims[2]:g}"
+            items[item, leaf.material] += 1
+            continue
+        path = leaf.path.split("/")
+        named = max(i for i, name in enumerate(path) if not name.startswith("#"))
+        part = "/".join(path[:named + 1])
+        if part not in parts:
+            parts.add(part)
+            items[path[named], leaf.material] += 1
+    return items
+
+
+def order_rows(index, variant="custom"):
+    """Rows of the order tables for an indexed closet, without order number and time."""
+    cut_list = Counter(
+        (leaf.material, leaf.label, leaf.dims[0], min(leaf.dims[1:]), max(leaf.dims[1:]))
+        for material in ["board", "back panel", "mirror"]
+        for leaf in index.query(material=material)
+    )
+    hardware = hardware_items(index)
+    dowels = index.count(material="dowel")
+    return {
+        "orders": [{
+            "variant": variant,
+            "width": width,
+            "depth": depth,
+            "height": height,
+            "panels": sum(cut_list.values()),
+            "dowels": dowels,
+            # Every dowel sits in a hole in both panels it connects
+            "holes": 2 * dowels,
+        }],
+        "cut_list": [
+            {
+                "material": material,
+                "name": name,
+                "thickness": part_thickness,
+                "width": part_width,
+                "height": part_height,
+                "count": count,
+                "area": part_width * part_height * count / 1e6,
+            }
+            for (material, name, part_thickness, part_width, part_height), count
+            in sorted(cut_list.items())
+        ],
+        "hardware": [
+            {"item": item, "material": material, "count": count}
+            for (item, material), count in sorted(hardware.items())
+        ],
+    }
+
+
+def record_order(store, rows, order=None, timestamp=None):
+    """Append the rows of one order to the store and return its order number."""
+    # Hold the lock from picking the number to the last append, so no other
+    # instance hands out the same number
+    with store.lock():
+        if order is None:
+            orders = store.column("orders", "order")
+            order = int(orders.max()) + 1 if len(orders) else 1
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        for table, table_rows in rows.items():
+            store.append(table, [dict(row, order=order, timestamp=timestamp) for row in table_rows])
+    return order
+
+
+def print_order_summary(store, since=None):
+    print(f"\nOrders: {store.total('orders', since=since)}")
+    print("Board area per thickness (m²):")
+    for board_thickness, area in store.total(
+        "cut_list", "area", by="thickness", since=since, material="board"
+    ).items():
+        print(f"  {board_thickness:5.1f}mm: {area:8.2f}")
+    print(f"Dowels: {store.total('orders', 'dowels', since=since):.0f}, "
+          f"holes: {store.total('orders', 'holes', since=since):.0f}")
+    for item, count in store.total("hardware", "count", by="item", since=since).items():
+        print(f"  {count:6.0f} * {item}")
+
+
+# Record this closet as an order and summarize the store
+# order_store = OrderStore("orders")
+# record_order(order_store, order_rows(AssemblyIndex(posable_closet)))
+# print_order_summary(order_store)
+
+
+# %%
+###############################################################################
+#                           BATCH RENDERING                                   #
+#        Builds and renders every stock variant in forked headless            #
+#              workers and writes the images with a manifest                  #
+###############################################################################
+STOCK_VARIANTS = {
+    f"w{variant_width:g}-p{variant_pants_left:g}-{variant_pants_right:g}": {
+        "width": variant_width,
+        "pants_height_left": variant_pants_left,
+        "pants_height_right": variant_pants_right,
+    }
+    for variant_width in [154.5, 174.5, 194.5]
+    for variant_pants_left, variant_pants_right in [(73.0, 63.0), (63.0, 63.0), (73.0, 73.0)]
+}
+
+_worker_namespace = {}
+
+
+def notebook_cells(notebook_path, until="BATCH RENDERING"):
+    """(title, source) of the cells of the notebook before the cell titled until.
+
+    Cells start at a "# %%" line and are titled by the first line of the
+    banner at their top, cells without a banner are titled "SETUP". Code
+    that mentions a title does not end the notebook early.
+    """
+    with open(notebook_path) as f:
+        sources = re.split(r"^# %%.*$", f.read(), flags=re.MULTILINE)
+
+    cells = []
+    for source in sources:
+        banner = re.match(r"\s*#{10,}\n#\s+(.*?)\s+#\n", source)
+        title = banner.group(1) if banner else "SETUP"
+        if title == until:
+            return cells
+        cells.append((title, source))
+    raise ValueError(f"{notebook_path} has no cell titled {until}")
+
+
+def _pipe_worker(connection, work):
+    """Run work(name, parameters) for every variant the parent sends until it sends None.
+
+    work returns (result, recycle). A worker that is to be recycled sends
+    its result and exits, the parent forks a fresh one.
+    """
+    for name, parameters in iter(connection.recv, None):
+        try:
+            result, recycle = work(name, parameters)
+        except Exception as error:
+            connection.send((None, repr(error), False))
+            continue
+        connection.send((result, None, recycle))
+        if recycle:
+            return
+
+
+def run_workers(work, variants, processes=None):
+    """Run work(name, parameters) for every variant in forked worker processes.
+
+    Forked workers inherit the notebook namespace, functions and rails
+    included. Every worker has its own pipe and gets one variant at a time.
+    A worker that dies, from a crash in OCC or the OOM killer, only fails its
+    own variant. It is replaced and cannot leave a lock shared with the
+    other workers behind.
+
+    Args:
+        work (callable): Returns (result, recycle) for a name and parameters.
+        variants (dict): Parameters per variant name.
+        processes (int, optional): Number of workers, defaults to the CPU count.
+
+    Yields:
+        tuple: (name, result, error) as the variants finish, error is None
+            or the error of the variant.
+    """
+    context = multiprocessing.get_context("fork")
+
+    def start_worker():
+        connection, worker_connection = context.Pipe()
+        worker = context.Process(target=_pipe_worker, args=(worker_connection, work))
+        worker.start()
+        worker_connection.close()
+        return connection, worker
+
+    pending = list(variants.items())
+    building = {}
+
+    def send_variant(connection, worker):
+        name, parameters = pending.pop(0)
+        connection.send((name, parameters))
+        building[connection] = (worker, name)
+
+    try:
+        for _ in range(min(processes or os.cpu_count(), len(pending))):
+            send_variant(*start_worker())
+
+        while building:
+            for connection in multiprocessing.connection.wait(list(building)):
+                worker, name = building.pop(connection)
+                try:
+                    result, error, recycle = connection.recv()
+                except EOFError:
+                    worker.join()
+                    result, error, recycle = None, f"worker exited with code {worker.exitcode}", True
+
+                if recycle:
+                    connection.close()
+                    worker.join()
+                    if pending:
+                        connection, worker = start_worker()
+                if pending:
+                    send_variant(connection, worker)
+                elif not recycle:
+                    connection.send(None)
+                    worker.join()
+                yield name, result, error
+    finally:
+        # Only left running when the caller stopped early
+        for worker, _ in building.values():
+            worker.terminate()
+
+
+def _render_variant(notebook_path, name, parameters, output_dir):
+    """Build a variant by running the cells before this one headless, then render it.
+
+    Every worker process keeps its own namespace and starts with the scaled
+    rails of the notebook it was forked from, so the rails STEP file is not
+    imported again.
+    """
+    started = time.time()
+    if "scaled_rails" in globals():
+        _worker_namespace.setdefault("scaled_rails", globals()["scaled_rails"])
+    _worker_namespace.update(headless=True, variant_parameters=parameters)
+    for _, cell in notebook_cells(notebook_path):
+        exec(cell, _worker_namespace)
+
+    posable = _worker_namespace["posable_closet"]
+    images = _worker_namespace["render_views"](posable, name, output_dir)
+    rows = _worker_namespace["order_rows"](_worker_namespace["AssemblyIndex"](posable), name)
+    return {
+        "name": name,
+        "parameters": parameters,
+        "images": images,
+        "seconds": round(time.time() - started, 1),
+    }, rows
+
+
+def render_catalog(variants, output_dir="renders", processes=None, notebook_path="kledingkast.py", store=None):
+    """Render all variants in worker processes and write <output_dir>/manifest.json.
+
+    Args:
+        variants (dict): Parameter overrides per variant name.
+        processes (int, optional): Number of workers, defaults to the CPU count.
+        store (OrderStore, optional): Records every variant as an order. Only
+            this process writes to the store.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = []
+
+    def work(name, parameters):
+        return _render_variant(notebook_path, name, parameters, output_dir), False
+
+    for name, result, error in run_workers(work, variants, processes):
+        if error is None:
+            entry, rows = result
+            if store is not None:
+                entry["order"] = record_order(store, rows)
+        else:
+            entry = {"name": name, "parameters": variants[name], "error": error}
+        print(f"{entry['name']}: {entry.get('seconds', entry.get('error'))}")
+        manifest.append(entry)
+
+    manifest.sort(key=lambda entry: entry["name"])
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# Render the full catalog, this takes a while
+# render_catalog(STOCK_VARIANTS)
+
+
+# %%
+###############################################################################
+#                           ASSEMBLY DRAWINGS                                 #
+#        Dimensioned front, left and top views of the sub-assemblies and      #
+#          a panel sheet, with one hidden-line projection per prototype       #
+###############################################################################
+_projection_cache = {}
+
+DRAWING_VIEWS = {
+    # View name: (view direction, up direction), in first angle projection
+    # the left view goes right of the front view and the top view below it
+    "front": ((0, 1, 0), (0, 0, 1)),
+    "left": ((1, 0, 0), (0, 0, 1)),
+    "top": ((0, 0, -1), (0, 1, 0)),
+}
+
+DRAWING_SHEETS = {
+    # Sheet name: top level group of the posable closet
+    "Frame": "Frame",
+    "Sub closet left": "Sub closet left",
+    "Sub closet right": "Sub closet right",
+    "Door": "Door left",
+}
+
+DRAWING_SCALES = [5, 10, 20, 25, 50, 100]
+
+sheet_size = (420.0, 297.0)  # A3 landscape (mm)
+sheet_margin = 10.0
+table_width = 100.0  # Parts list and title block on the right of the sheet
+view_gap = 30.0  # Room for the dimensions between the views
+
+# Materials drawn as opaque boxes that hide the parts behind them
+opaque_materials = ["board", "back panel", "mirror"]
+
+
+def _polyline(edge):
+    """Points (cm) along a projected edge, lines only need their end points."""
+    steps = [0.0, 1.0] if edge.geom_type == GeomType.LINE else np.linspace(0.0, 1.0, 17)
+    return np.array([edge.position_at(step).to_tuple()[:2] for step in steps])
+
+
+def prototype_projection(shape, direction, up):
+    """Visible and hidden lines of a leaf seen along a direction in its own frame.
+
+    Hidden-line removal is slow, so it runs once per geometry hash and
+    relative view direction. Copies and identical parts with the same
+    orientation share the result and are only shifted on the sheet.
+
+    Returns:
+        tuple: Lists of (n, 2) point arrays (cm) of the visible and hidden
+            lines, x to the right and y up, around the origin of the shape.
+    """
+    dims, _ = leaf_signature(shape)
+    key = (dims, leaf_digest(shape), _rounded(direction, 6), _rounded(up, 6))
+    if key not in _projection_cache:
+        location = shape.location
+        shape.location = Location()
+        try:
+            visible, hidden = Compound([shape]).project_to_viewport(
+                tuple(-value for value in direction), up, (0, 0, 0)
+            )
+        finally:
+            shape.location = location
+        _projection_cache[key] = (
+            [_polyline(edge) for edge in visible],
+            [_polyline(edge) for edge in hidden],
+        )
+    return _projection_cache[key]
+
+
+def project_leaves(leaves, direction, up):
+    """Projected lines of located leaves, sorted from far to near.
+
+    Returns:
+        list: (visible, hidden, fill) per leaf, where fill is the (min, max)
+            corner of an opaque panel or None.
+    """
+    direction = np.array(direction, dtype=float)
+    up = np.array(up, dtype=float)
+    right = np.cross(up, -direction)
+    projected = []
+    for leaf in leaves:
+        matrix = location_matrix(leaf.location)
+        rotation, position = matrix[:, :3], matrix[:, 3]
+        # The prototype sees the view direction rotated back into its frame
+        visible, hidden = prototype_projection(
+            leaf.shape, tuple(rotation.T @ direction), tuple(rotation.T @ up)
+        )
+        offset = np.array([position @ right, position @ up])
+        visible = [points + offset for points in visible]
+        hidden = [points + offset for points in hidden]
+        fill = None
+        if leaf.material in opaque_materials and visible:
+            points = np.concatenate(visible)
+            fill = (points.min(axis=0), points.max(axis=0))
+        depth = (position + rotation @ leaf.center.to_tuple()) @ direction
+        projected.append((depth, visible, hidden, fill))
+
+    projected.sort(key=lambda item: -item[0])
+    return [(visible, hidden, fill) for _, visible, hidden, fill in projected]
+
+
+class Sheet:
+    def __init__(self, name, size=sheet_size):
+        """A drawing sheet in mm with the origin in the bottom left corner."""
+        self.name = name
+        self.size = size
+        self.lines = []  # (points, style)
+        self.fills = []  # (x, y, width, height)
+        self.texts = []  # (x, y, text, size, anchor, rotation)
+        self.items = []  # Drawing order, ("line" | "fill" | "text", index)
+
+    def line(self, points, style="visible"):
+        self.items.append(("line", len(self.lines)))
+        self.lines.append((np.asarray(points, dtype=float), style))
+
+    def fill(self, x, y, width, height):
+        self.items.append(("fill", len(self.fills)))
+        self.fills.append((x, y, width, height))
+
+    def text(self, x, y, text, size=3.5, anchor="start", rotation=0):
+        self.items.append(("text", len(self.texts)))
+        self.texts.append((x, y, text, size, anchor, rotation))
+
+    def rectangle(self, x, y, width, height, style="thin"):
+        self.line([(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)], style)
+
+    def dimension(self, start, end, offset, text=None, vertical=False):
+        """Dimension between two points along x, or along y when vertical.
+
+        The dimension line is drawn offset mm beyond the points, below or
+        left of them for a negative offset.
+        """
+        along, across = (1, 0) if vertical else (0, 1)
+        sides = [start[across], end[across]]
+        position = (min(sides) if offset < 0 else max(sides)) + offset
+        direction = 1.0 if offset > 0 else -1.0
+
+        def point(along_value, across_value):
+            result = [0.0, 0.0]
+            result[along], result[across] = along_value, across_value
+            return result
+
+        for corner in [start, end]:
+            self.line([
+                point(corner[along], corner[across] + direction),
+                point(corner[along], position + direction),
+            ], "thin")
+            # Oblique ticks, as used on furniture drawings
+            self.line([
+                point(corner[along] - 1.2, position - 1.2),
+                point(corner[along] + 1.2, position + 1.2),
+            ], "thin")
+        self.line([point(start[along], position), point(end[along], position)], "thin")
+
+        if text:
+            middle = (start[along] + end[along]) / 2
+            if vertical:
+                self.text(position - 1.2, middle, text, 2.5, "middle", 90)
+            else:
+                self.text(middle, position + 1.2, text, 2.5, "middle")
+
+
+def _view_extent(projected):
+    points = np.concatenate([
+        points for visible, hidden, _ in projected for points in visible + hidden
+    ])
+    return points.min(axis=0), points.max(axis=0)
+
+
+def _chain_positions(projected, axis, low, high):
+    """Sheet positions of the edges of panels that span most of the view across axis."""
+    across = 1 - axis
+    positions = {round(low[axis], 2), round(high[axis], 2)}
+    for _, _, fill in projected:
+        if fill and fill[1][across] - fill[0][across] > (high[across] - low[across]) / 2:
+            positions.update([round(fill[0][axis], 2), round(fill[1][axis], 2)])
+    return sorted(positions)
+
+
+def _draw_view(sheet, projected, origin, scale, low, high, vertical_side):
+    """Draw projected leaves with their lowest corner at origin on the sheet, with dimensions."""
+    factor = 10.0 / scale
+
+    def to_sheet(points):
+        return (points - low) * factor + origin
+
+    for visible, hidden, fill in projected:
+        if fill:
+            corner = to_sheet(fill[0])
+            size = (fill[1] - fill[0]) * factor
+            sheet.fill(corner[0], corner[1], size[0], size[1])
+        for points in hidden:
+            sheet.line(to_sheet(points), "hidden")
+        for points in visible:
+            sheet.line(to_sheet(points), "visible")
+
+    bottom_left, top_right = to_sheet(low), to_sheet(high)
+    # Overall dimensions outside the chains of panel positions
+    sheet.dimension(bottom_left, (top_right[0], bottom_left[1]), -8, f"{(high[0] - low[0]) * 10:.1f}")
+    side = top_right[0] if vertical_side > 0 else bottom_left[0]
+    sheet.dimension((side, bottom_left[1]), (side, top_right[1]), 16 * vertical_side,
+                    f"{(high[1] - low[1]) * 10:.1f}", vertical=True)
+
+    for axis in [0, 1]:
+        positions = _chain_positions(projected, axis, low, high)
+        for start, end in zip(positions, positions[1:]):
+            text = f"{(end - start) * 10:.1f}" if (end - start) * factor > 8 else None
+            if axis == 0:
+                sheet.dimension(
+                    (to_sheet(np.array([start, high[1]]))[0], top_right[1]),
+                    (to_sheet(np.array([end, high[1]]))[0], top_right[1]),
+                    8, text,
+                )
+            else:
+                sheet.dimension(
+                    (side, to_sheet(np.array([low[0], start]))[1]),
+                    (side, to_sheet(np.array([low[0], end]))[1]),
+                    8 * vertical_side, text, vertical=True,
+                )
+
+
+def _title_block(sheet, title, scale, rows):
+    """Parts list and title block in the column on the right of the sheet."""
+    x = sheet.size[0] - sheet_margin - table_width
+    top = sheet.size[1] - sheet_margin
+    sheet.text(x + 2, top - 6, "Parts", 3.5)
+    for i, (count, name, dims) in enumerate(rows):
+        y = top - 12 - i * 5
+        sheet.text(x + 2, y, f"{count}x", 2.5)
+        sheet.text(x + 10, y, name, 2.5)
+        sheet.text(x + table_width - 2, y, " x ".join(f"{d:g}" for d in dims), 2.5, "end")
+
+    sheet.rectangle(x, sheet_margin, table_width, 24)
+    sheet.text(x + 2, sheet_margin + 16, title, 5)
+    sheet.text(x + 2, sheet_margin + 9, f"Closet {width * 10:g} x {depth * 10:g} x {height * 10:g} mm", 2.5)
+    sheet.text(x + 2, sheet_margin + 3, f"Scale 1:{scale}, dimensions in mm", 2.5)
+    sheet.rectangle(sheet_margin, sheet_margin, sheet.size[0] - 2 * sheet_margin, sheet.size[1] - 2 * sheet_margin)
+
+
+def assembly_sheet(title, leaves):
+    """Sheet with the front, left and top views of a group of leaves."""
+    views = {
+        view: project_leaves(leaves, direction, up)
+        for view, (direction, up) in DRAWING_VIEWS.items()
+    }
+    extents = {view: _view_extent(projected) for view, projected in views.items()}
+    sizes = {view: high - low for view, (low, high) in extents.items()}
+
+    # The views share their axes: the left view sits right of the front
+    # view and the top view below it
+    available = np.array([
+        sheet_size[0] - 2 * sheet_margin - table_width - 3 * view_gap,
+        sheet_size[1] - 2 * sheet_margin - 3 * view_gap,
+    ])
+    needed = np.array([
+        sizes["front"][0] + sizes["left"][0],
+        sizes["front"][1] + sizes["top"][1],
+    ]) * 10
+    scale = next((s for s in DRAWING_SCALES if (needed / s <= available).all()), DRAWING_SCALES[-1])
+
+    factor = 10.0 / scale
+    top_origin = np.array([sheet_margin + 1.5 * view_gap, sheet_margin + view_gap])
+    front_origin = top_origin + [0, sizes["top"][1] * factor + view_gap]
+    left_origin = front_origin + [sizes["front"][0] * factor + view_gap, 0]
+
+    sheet = Sheet(title)
+    _draw_view(sheet, views["front"], front_origin, scale, *extents["front"], -1)
+    _draw_view(sheet, views["left"], left_origin, scale, *extents["left"], 1)
+    _draw_view(sheet, views["top"], top_origin, scale, *extents["top"], -1)
+
+    rows = Counter(
+        (leaf.label or leaf.material, tuple(reversed(leaf.dims)))
+        for leaf in leaves if leaf.material in opaque_materials
+    )
+    rows = [(count, name, dims) for (name, dims), count in sorted(rows.items(), key=lambda row: (-row[0][1][0], row[0][0]))]
+    _title_block(sheet, title, scale, rows)
+    return sheet
+
+
+def panel_sheet(leaves, title="Panels"):
+    """Sheet with every unique panel as a dimensioned rectangle."""
+    panels = Counter()
+    names = {}
+    for leaf in leaves:
+        if leaf.material in opaque_materials:
+            # Mirrored copies can lose their labels, so panels are grouped by size
+            panels[leaf.material, leaf.dims] += 1
+            if leaf.label:
+                names.setdefault((leaf.material, leaf.dims), set()).add(leaf.label)
+    panels = sorted(panels.items(), key=lambda panel: (-panel[0][1][2], -panel[0][1][1]))
+    available = np.array([sheet_size[0] - 2 * sheet_margin - table_width, sheet_size[1] - 2 * sheet_margin])
+
+    for scale in DRAWING_SCALES:
+        # Place the panels in rows, tallest first
+        placements = []
+        x, y, row_height = 0.0, 0.0, 0.0
+        for (material, dims), count in panels:
+            panel_width, panel_height = dims[1] / scale, dims[2] / scale
+            if x + panel_width + 30 > available[0] and x:
+                x, y, row_height = 0.0, y + row_height + 25, 0.0
+            placements.append((x, y, panel_width, panel_height))
+            x += panel_width + 30
+            row_height = max(row_height, panel_height)
+        if y + row_height + 25 <= available[1]:
+            break
+
+    sheet = Sheet(title)
+    top = sheet_size[1] - sheet_margin - 10
+    for ((material, dims), count), (x, y, panel_width, panel_height) in zip(panels, placements):
+        corner = (sheet_margin + 20 + x, top - y - panel_height)
+        sheet.rectangle(corner[0], corner[1], panel_width, panel_height, "visible")
+        sheet.dimension(corner, (corner[0] + panel_width, corner[1]), -6, f"{dims[1]:g}")
+        sheet.dimension(corner, (corner[0], corner[1] + panel_height), -6, f"{dims[2]:g}", vertical=True)
+        sheet.text(corner[0] + panel_width / 2, corner[1] + panel_height / 2 + 1, f"{count}x", 3.5, "middle")
+        sheet.text(corner[0] + panel_width / 2, corner[1] + panel_height / 2 - 3, f"{dims[0]:g} {material}", 2.5, "middle")
+
+    rows = [
+        (count, ", ".join(sorted(names.get((material, dims), [material]))), tuple(reversed(dims)))
+        for (material, dims), count in panels
+    ]
+    _title_block(sheet, title, scale, rows)
+    return sheet
+
+
+SHEET_STYLES = {
+    # Style: (line width in mm, dash pattern in mm, gray level)
+    "visible": (0.35, None, 0.0),
+    "hidden": (0.18, (1.5, 1.0), 0.5),
+    "thin": (0.18, None, 0.0),
+}
+
+
+def write_svg(path, sheet):
+    sheet_width, sheet_height = sheet.size
+    elements = []
+    for kind, i in sheet.items:
+        if kind == "line":
+            points, style = sheet.lines[i]
+            line_width, dash, gray = SHEET_STYLES[style]
+            coordinates = " ".join(f"{x:.2f},{sheet_height - y:.2f}" for x, y in points)
+            dash = f' stroke-dasharray="{dash[0]},{dash[1]}"' if dash else ""
+            elements.append(
+                f'<polyline points="{coordinates}" fill="none" stroke="rgb({gray * 255:.0f},{gray * 255:.0f},{gray * 255:.0f})" '
+                f'stroke-width="{line_width}"{dash}/>'
+            )
+        elif kind == "fill":
+            x, y, fill_width, fill_height = sheet.fills[i]
+            elements.append(
+                f'<rect x="{x:.2f}" y="{sheet_height - y - fill_height:.2f}" '
+                f'width="{fill_width:.2f}" height="{fill_height:.2f}" fill="white"/>'
+            )
+        else:
+            x, y, text, size, anchor, rotation = sheet.texts[i]
+            text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            transform = f' transform="rotate({-rotation} {x:.2f} {sheet_height - y:.2f})"' if rotation else ""
+            elements.append(
+                f'<text x="{x:.2f}" y="{sheet_height - y:.2f}" font-family="Helvetica, Arial, sans-serif" '
+                f'font-size="{size}" text-anchor="{anchor}"{transform}>{text}</text>'
+            )
+
+    with open(path, "w") as f:
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{sheet_width}mm" height="{sheet_height}mm" '
+            f'viewBox="0 0 {sheet_width} {sheet_height}">\n'
+            f'<rect width="{sheet_width}" height="{sheet_height}" fill="white"/>\n'
+            + "\n".join(elements)
+            + "\n</svg>\n"
+        )
+
+
+def write_pdf(path, sheets):
+    """Write sheets as the pages of a PDF, with the standard Helvetica font."""
+    points = 72 / 25.4
+
+    def page_content(sheet):
+        commands = [f"{points:.6f} 0 0 {points:.6f} 0 0 cm", "1 J 1 j"]
+        for kind, i in sheet.items:
+            if kind == "line":
+                line, style = sheet.lines[i]
+                line_width, dash, gray = SHEET_STYLES[style]
+                commands.append(f"{line_width} w {gray} G " + (f"[{dash[0]} {dash[1]}] 0 d" if dash else "[] 0 d"))
+                commands.append(
+                    f"{line[0][0]:.2f} {line[0][1]:.2f} m "
+                    + " ".join(f"{x:.2f} {y:.2f} l" for x, y in line[1:])
+                    + " S"
+                )
+            elif kind == "fill":
+                x, y, fill_width, fill_height = sheet.fills[i]
+                commands.append(f"1 g {x:.2f} {y:.2f} {fill_width:.2f} {fill_height:.2f} re f")
+            else:
+                x, y, text, size, anchor, rotation = sheet.texts[i]
+                # Helvetica is about half the font size wide per character
+                shift = {"start": 0.0, "middle": 0.5, "end": 1.0}[anchor] * 0.5 * size * len(text)
+                cos, sin = (0, 1) if rotation == 90 else (1, 0)
+                x, y = x - shift * cos, y - shift * sin
+                text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+                text = text.encode("latin-1", "replace").decode("latin-1")
+                commands.append(
+                    f"0 g BT /F1 {size} Tf {cos} {sin} {-sin} {cos} {x:.2f} {y:.2f} Tm ({text}) Tj ET"
+                )
+        return "\n".join(commands).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, once the page objects are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_numbers = []
+    for sheet in sheets:
+        content = zlib.compress(page_content(sheet))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        media_box = f"0 0 {sheet.size[0] * points:.2f} {sheet.size[1] * points:.2f}"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [{media_box}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>".encode()
+        )
+        page_numbers.append(len(objects))
+    kids = " ".join(f"{number} 0 R" for number in page_numbers)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode()
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def drawing_set(posable, output_dir, sheets=DRAWING_SHEETS, index=None):
+    """Write an SVG per sheet and all sheets in <output_dir>/drawings.pdf.
+
+    Args:
+        sheets (dict): Top level group of the posable closet per sheet name.
+    """
+    started = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    index = index or AssemblyIndex(posable)
+    drawn = [assembly_sheet(title, index.groups[group]) for title, group in sheets.items()]
+    drawn.append(panel_sheet(index.leaves))
+
+    filenames = []
+    for sheet in drawn:
+        filename = sheet.name.lower().replace(" ", "-") + ".svg"
+        write_svg(os.path.join(output_dir, filename), sheet)
+        filenames.append(filename)
+    write_pdf(os.path.join(output_dir, "drawings.pdf"), drawn)
+    print(f"{len(drawn)} drawing sheets in {time.time() - started:.1f}s "
+          f"({len(_projection_cache)} projected prototypes)")
+    return filenames + ["drawings.pdf"]
+
+
+if not headless:
+    drawing_set(posable_closet, "drawings")
+
+
+# %%
+###############################################################################
+#                            LEAN BUILD MODE                                  #
+#        Builds orders stage by stage in bounded memory, releasing the        #
+#         builders and shapes that later stages no longer refer to            #
+###############################################################################
+# Globals that outlive a build: the scaled rails are reused by every order
+lean_build_keep = ["scaled_rails"]
+# Shapes the outputs of an order are extracted from
+lean_build_outputs = ["posable_closet"]
+
+_lean_namespace = {}
+
+
+def _memory_usage():
+    """Current and peak resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        # Without procfs only the peak of the whole process is known
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def _reset_peak_memory():
+    try:
+        # Linux resets the peak resident set size when 5 is written here
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        # Hand the freed heap back to the system, glibc only
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _stage_names(cell):
+    """Names a cell refers to in code, ignoring strings and comments."""
+    tokens = tokenize.generate_tokens(io.StringIO(cell).readline)
+    return {token.string for token in tokens if token.type == tokenize.NAME}
+
+
+def _is_intermediate(value):
+    """Shapes and builder contexts, also when collected in a list or tuple."""
+    if isinstance(value, (list, tuple)):
+        return bool(value) and all(_is_intermediate(item) for item in value)
+    return isinstance(value, (Shape, BuildPart))
+
+
+def lean_build(name, parameters, notebook_path="kledingkast.py", output_dir=None):
+    """Build one order with the cells before the batch rendering cell.
+
+    After every stage the shapes and builder contexts that no later stage
+    refers to are released. Once the outputs are extracted the namespace of
+    the order is dropped, so a worker keeps only lean_build_keep between
+    orders.
+
+    Args:
+        name (str): Name of the order, used as variant and file name.
+        parameters (dict): Overrides of the global parameters.
+        output_dir (str, optional): Directory for <name>.design.json.
+
+    Returns:
+        tuple: (rows, report), the order store rows and per stage
+            (title, seconds, rss, peak rss, released) with memory in MB.
+    """
+    cells = notebook_cells(notebook_path)
+    later_names = [set(lean_build_outputs) for _ in cells]
+    for i in range(len(cells) - 2, -1, -1):
+        later_names[i] = later_names[i + 1] | _stage_names(cells[i + 1][1])
+
+    # A fresh worker starts with what the notebook it was forked from kept
+    namespace = {
+        key: _lean_namespace[key] if key in _lean_namespace else globals()[key]
+        for key in lean_build_keep if key in _lean_namespace or key in globals()
+    }
+    namespace.update(headless=True, variant_parameters=parameters)
+    report = []
+    for (title, cell), needed in zip(cells, later_names):
+        _reset_peak_memory()
+        started = time.time()
+        exec(cell, namespace)
+        released = [
+            key for key, value in namespace.items()
+            if key not in needed and key not in lean_build_keep and _is_intermediate(value)
+        ]
+        for key in released:
+            del namespace[key]
+        seconds = time.time() - started
+        _release_memory()
+        report.append((title, seconds, *_memory_usage(), len(released)))
+
+    # Extract the outputs, everything else of this order can go
+    _reset_peak_memory()
+    started = time.time()
+    posable = namespace["posable_closet"]
+    rows = namespace["order_rows"](namespace["AssemblyIndex"](posable), name)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        design = namespace["make_closet_design"](posable)
+        namespace["save_design"](design, os.path.join(output_dir, f"{name}.design.json"))
+
+    _lean_namespace.clear()
+    _lean_namespace.update({key: namespace[key] for key in lean_build_keep if key in namespace})
+    del posable, namespace
+    _release_memory()
+    report.append(("OUTPUTS", time.time() - started, *_memory_usage(), 0))
+    return rows, report
+
+
+def print_memory_report(name, report):
+    print(f"\n{name} (memory in MB):")
+    for title, seconds, rss, peak, released in report:
+        print(f"{title:>28} {seconds:6.1f}s rss {rss:7.1f} peak {peak:7.1f} released {released}")
+
+
+def _lean_order(name, parameters, notebook_path, output_dir, recycle_above):
+    """Build one order in a worker, recycling the worker when memory stays high.
+
+    A worker still over recycle_above after an order returns its rows with
+    a RECYCLE WORKER row in the report and is replaced.
+    """
+    rows, report = lean_build(name, parameters, notebook_path, output_dir)
+    recycle = recycle_above and report[-1][2] > recycle_above
+    if recycle:
+        # Drop what is kept between orders too, a fresh worker starts
+        # with the rails of the notebook anyway
+        _lean_namespace.clear()
+        _release_memory()
+        recycle = _memory_usage()[0] > recycle_above
+    if recycle:
+        report.append(("RECYCLE WORKER", 0.0, *_memory_usage(), 0))
+    return (rows, report), bool(recycle)
+
+
+def process_orders(variants, store=None, output_dir=None, processes=None,
+                   recycle_above=1500, notebook_path="kledingkast.py"):
+    """Build orders in lean mode in worker processes and record them in a store.
+
+    Args:
+        variants (dict): Parameter overrides per order name.
+        store (OrderStore, optional): Store for the cut list and hardware rows.
+        output_dir (str, optional): Directory for the design of every order.
+        recycle_above (float): Resident set size (MB) above which a worker is
+            replaced after finishing an order. It is not a limit while an
+            order is built.
+
+    Returns:
+        dict: Memory report per order name, or the error of the order.
+    """
+    def work(name, parameters):
+        return _lean_order(name, parameters, notebook_path, output_dir, recycle_above)
+
+    reports = {}
+    for name, result, error in run_workers(work, variants, processes):
+        if error is not None:
+            reports[name] = error
+            print(f"{name}: {error}")
+            continue
+        rows, reports[name] = result
+        if store is not None:
+            record_order(store, rows)
+        print_memory_report(name, reports[name])
+    return reports
+
+
+# Build and record every stock variant in lean mode, this takes a while
+# process_orders(STOCK_VARIANTS, OrderStore("orders"))
 
 
 # %%
\ No newline at end of file